@@ -1,7 +1,7 @@
 ﻿# -*- coding: utf-8 -*-
 # matcher.py
 
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Callable, Optional
 from unifier import unify_two
 from parser import parse_literal
 
@@ -81,3 +81,205 @@ def find_all_matches_multiple(
 
     dfs(0, {})
     return results
+
+# Scene index: (pred, arity) -> list of argument tuples, and
+# (pred, arity, position) -> {constant: list of argument tuples}.
+SceneIndex = Dict[tuple, object]
+CompiledMatcher = Callable[[SceneIndex], List[Dict[str, str]]]
+
+# Compiled matchers cached by the canonical (sorted) literal tuple of a Subformula.
+_COMPILED_MATCHERS: Dict[Tuple[str, ...], CompiledMatcher] = {}
+# Node-counting variants (see compile_matcher(count_nodes=True)), cached separately.
+_COUNTING_MATCHERS: Dict[Tuple[str, ...], CompiledMatcher] = {}
+
+# Total number of DFS nodes (partial bindings) visited by node-counting matchers.
+MATCH_NODES = [0]
+
+def index_scene(S_union: List[Tuple[str, List[str]]]) -> SceneIndex:
+    """
+    Build the lookup index used by compiled matchers from ground atoms S_union.
+    Built once per scene and shared by every compiled matcher.
+    """
+    index: SceneIndex = {}
+    for pred, args in S_union:
+        args_t = tuple(args)
+        arity = len(args_t)
+        index.setdefault((pred, arity), []).append(args_t)
+        for pos, const in enumerate(args_t):
+            index.setdefault((pred, arity, pos), {}).setdefault(const, []).append(args_t)
+    return index
+
+def _plan_join_order(parsed: List[Tuple[str, List[str]]]) -> List[int]:
+    """
+    Fix the join order of the template literals: start with the first literal,
+    then repeatedly take the literal with the most arguments already bound
+    (constants or variables bound by earlier literals); ties keep template order.
+    """
+    order: List[int] = []
+    bound = set()
+    remaining = list(range(len(parsed)))
+    while remaining:
+        if not order:
+            best = remaining[0]
+        else:
+            best = max(remaining, key=lambda k: (
+                sum(1 for a in parsed[k][1] if not a.islower() or a in bound), -k))
+        order.append(best)
+        remaining.remove(best)
+        bound.update(a for a in parsed[best][1] if a.islower())
+    return order
+
+# CPython allows at most 20 statically nested blocks; templates with more literals
+# than this run as a step-wise join instead of generated nested loops.
+MAX_NESTED_LITERALS = 16
+
+# A join step: (index key, lookup value spec or None, checks, binds, repeat checks).
+# A value spec is (True, slot) for a bound variable or (False, constant);
+# checks are (position, value spec), binds and repeat checks are (position, slot).
+JoinStep = Tuple[tuple, Optional[Tuple[bool, object]], List[Tuple[int, Tuple[bool, object]]],
+                 List[Tuple[int, int]], List[Tuple[int, int]]]
+
+def _plan_steps(lits: Tuple[str, ...]) -> Tuple[List[JoinStep], List[str]]:
+    """
+    Fix, for the template `lits`, the join order and for each step the index key,
+    the bound-argument checks and the new variable bindings.
+    Returns the steps and the variable names in slot order.
+    """
+    parsed = []
+    for lit in lits:
+        pred, args, _ = parse_literal(lit)
+        parsed.append((pred, args))
+
+    var_slot: Dict[str, int] = {}
+    steps: List[JoinStep] = []
+    for k in _plan_join_order(parsed):
+        pred, args = parsed[k]
+        # Positions whose value is known before this step: constants and bound variables
+        known = [(pos, (True, var_slot[a]) if a.islower() else (False, a))
+                 for pos, a in enumerate(args) if not a.islower() or a in var_slot]
+        if known:
+            # Look up by the first known position; verify the rest per row
+            key = (pred, len(args), known[0][0])
+            lookup = known[0][1]
+            checks = known[1:]
+        else:
+            key = (pred, len(args))
+            lookup = None
+            checks = []
+        binds: List[Tuple[int, int]] = []
+        repeats: List[Tuple[int, int]] = []
+        known_positions = {pos for pos, _ in known}
+        for pos, a in enumerate(args):
+            if not a.islower() or pos in known_positions:
+                continue
+            if a in var_slot:
+                # Repeated variable inside the same literal must bind to the same constant
+                repeats.append((pos, var_slot[a]))
+                continue
+            var_slot[a] = len(var_slot)
+            binds.append((pos, var_slot[a]))
+        steps.append((key, lookup, checks, binds, repeats))
+    return steps, list(var_slot)
+
+def _render_value(spec: Tuple[bool, object]) -> str:
+    is_slot, value = spec
+    return f"v{value}" if is_slot else repr(value)
+
+def _generate_matcher_source(lits: Tuple[str, ...], count_nodes: bool = False) -> str:
+    """
+    Generate the source of a specialized matching function for the template `lits`:
+    one nested loop per literal in the planned join order, with constant checks,
+    bound-variable checks and the index key of each loop fixed in the code.
+    If count_nodes is True, every consistent partial binding (including the empty root)
+    increments _NODES[0], as one dfs() call would in find_all_matches_multiple.
+    """
+    steps, var_names = _plan_steps(lits)
+    # Index lookups are resolved once per call, before the nested loops
+    prologue = ["def _match(index):", "    results = []"]
+    if count_nodes:
+        prologue.append("    _NODES[0] += 1")
+    lines: List[str] = []
+    depth = 1
+    for step, (key, lookup, checks, binds, repeats) in enumerate(steps):
+        ind = "    " * depth
+        row = f"a{step}"
+        if lookup is not None:
+            prologue.append(f"    i{step} = index.get({key!r}, _EMPTY)")
+            lines.append(f"{ind}for {row} in i{step}.get({_render_value(lookup)}, ()):")
+        else:
+            prologue.append(f"    i{step} = index.get({key!r}, ())")
+            lines.append(f"{ind}for {row} in i{step}:")
+        ind += "    "
+        for pos, spec in checks:
+            lines.append(f"{ind}if {row}[{pos}] != {_render_value(spec)}:")
+            lines.append(f"{ind}    continue")
+        for pos, slot in binds:
+            lines.append(f"{ind}v{slot} = {row}[{pos}]")
+        for pos, slot in repeats:
+            lines.append(f"{ind}if {row}[{pos}] != v{slot}:")
+            lines.append(f"{ind}    continue")
+        if count_nodes:
+            lines.append(f"{ind}_NODES[0] += 1")
+        depth += 1
+    ind = "    " * depth
+    items = ", ".join(f"{v!r}: v{slot}" for slot, v in enumerate(var_names))
+    lines.append(f"{ind}results.append({{{items}}})")
+    lines.append("    return results")
+    return "\n".join(prologue + lines) + "\n"
+
+def _stepwise_matcher(lits: Tuple[str, ...], count_nodes: bool = False) -> CompiledMatcher:
+    """
+    Build a matcher for long templates (more than MAX_NESTED_LITERALS literals).
+    It runs the same planned steps as the generated code, but joins one step at a
+    time over a list of partial bindings (tuples of slot values) instead of nesting
+    loops, so it has no limit on template length. Results, their order and the
+    node count equal those of the generated matcher.
+    """
+    steps, var_names = _plan_steps(lits)
+
+    def _match(index: SceneIndex) -> List[Dict[str, str]]:
+        if count_nodes:
+            MATCH_NODES[0] += 1
+        partials: List[tuple] = [()]
+        for key, lookup, checks, binds, repeats in steps:
+            table = index.get(key, {} if lookup is not None else ())
+            extended: List[tuple] = []
+            for part in partials:
+                if lookup is not None:
+                    rows = table.get(part[lookup[1]] if lookup[0] else lookup[1], ())
+                else:
+                    rows = table
+                for row in rows:
+                    if any(row[pos] != (part[v] if is_slot else v) for pos, (is_slot, v) in checks):
+                        continue
+                    new_part = part + tuple(row[pos] for pos, _ in binds)
+                    if any(row[pos] != new_part[slot] for pos, slot in repeats):
+                        continue
+                    extended.append(new_part)
+            if count_nodes:
+                MATCH_NODES[0] += len(extended)
+            partials = extended
+        return [dict(zip(var_names, part)) for part in partials]
+
+    return _match
+
+def compile_matcher(lits: Tuple[str, ...], count_nodes: bool = False) -> CompiledMatcher:
+    """
+    Return the compiled matcher for a canonical literal tuple (Subformula.literals),
+    generating it on first use. The returned function takes a scene index
+    (see index_scene) and returns the same substitutions as find_all_matches_multiple.
+    Templates longer than MAX_NESTED_LITERALS get a step-wise join matcher.
+    With count_nodes=True, an instrumented variant that adds to MATCH_NODES is returned.
+    """
+    cache = _COUNTING_MATCHERS if count_nodes else _COMPILED_MATCHERS
+    matcher = cache.get(lits)
+    if matcher is None:
+        if len(lits) > MAX_NESTED_LITERALS:
+            matcher = _stepwise_matcher(lits, count_nodes)
+        else:
+            namespace = {"_EMPTY": {}, "_NODES": MATCH_NODES}
+            source = _generate_matcher_source(lits, count_nodes)
+            exec(compile(source, f"<matcher {'&'.join(lits)}>", "exec"), namespace)
+            matcher = namespace["_match"]
+        cache[lits] = matcher
+    return matcher
@@ -7,21 +7,23 @@ from typing import List, Dict, Tuple, Set
 
 from parser import read_classes_list, read_scene, parse_conjunction, parse_literal
 from level_finder import extract_level
+from sharding import extract_level_sharded
 from selector import select_and_register_predicates
 import utils
-from matcher import find_all_matches_multiple
+from matcher import compile_matcher, index_scene, SceneIndex
 from output_writer import save_level_objects, save_final_descriptions
-from subformula import Subformula
-from utils import update_thresholds
+from subformula import Subformula, RawSubformula, clear_interned_literals
+from utils import update_thresholds, rss_report
 
 def build_level_objects(
     level: int,
     registered: List[Subformula],
     subf_to_name: Dict[Subformula, str],
-    S_union: List[Tuple[str, List[str]]]
+    S_index: SceneIndex
 ) -> List[List[Tuple[str, ...]]]:
     """
-    For each registered Subformula at this level, find all matches in S_union (ground atoms).
+    For each registered Subformula at this level, find all matches in the scene
+    (S_index, built by index_scene from the ground atoms) using its compiled matcher.
     Returns a list of lists: each inner list contains all unique ground assignments (tuples of constants)
     for one Subformula. The order of constants in each tuple is determined by
     the variable order in the first literal of that Subformula.
@@ -29,7 +31,7 @@ def build_level_objects(
     level_objects: List[List[Tuple[str, ...]]] = []
     for sf in registered:
         lits = sf.literals  # e.g. ["P(x0,x1)", "Q(x1,x2)"]
-        matches = find_all_matches_multiple(lits, S_union)
+        matches = compile_matcher(lits)(S_index)
 
         # Filter out duplicate assignments using a set
         unique_tuples: Set[Tuple[str, ...]] = set()
@@ -47,17 +49,29 @@ def build_level_objects(
 
     return level_objects
 
-def main():
-    if len(sys.argv) != 3:
-        print("Usage: python ml_builder.py <classes_list.txt> <scene.txt>")
-        sys.exit(1)
-
-    classes_file = sys.argv[1]
-    scene_file = sys.argv[2]
+def extract_raw_level(
+    level: int,
+    classes_conj: List[List[str]],
+    num_classes: int,
+    classes_file: str,
+    num_shards: int
+) -> List[RawSubformula]:
+    """
+    Extract raw subformulas for one level, either in-process or, if num_shards > 1,
+    via local shard workers whose outputs are merged (identical result).
+    """
+    if num_shards > 1:
+        return extract_level_sharded(level, classes_file, num_shards)
+    return extract_level(level, classes_conj, list(range(len(classes_conj))), num_classes)
 
+def run(classes_file: str, scene_file: str, num_shards: int = 1):
+    """
+    Run the full multi-level pipeline and write results into output/.
+    """
     # Step 1: Read input files
     classes_conj, num_classes = read_classes_list(classes_file)
     S_union = read_scene(scene_file)
+    S_index = index_scene(S_union)
 
     # Step 2: Compute base thresholds (max literals, max vars across all class‐conjunctions)
     base_max_lits = 0
@@ -78,7 +92,7 @@ def main():
     max_possible_levels = num_classes + 2
 
     # Prepare data structures to hold raw/registered subformulas and mappings
-    raw_subf_by_level: Dict[int, List[Dict]] = {}
+    raw_subf_by_level: Dict[int, List[RawSubformula]] = {}
     registered_subf_by_level: Dict[int, List[Subformula]] = {}
     subf_to_name_by_level: Dict[int, Dict[Subformula, str]] = {}
     final_subfs: Dict[int, List[Subformula]] = {}
@@ -86,7 +100,8 @@ def main():
 
     # --- Level 1 ---
     print("[DEBUG] Building level 1 ...")
-    raw_subf_by_level[1] = extract_level(1, classes_conj, list(range(len(classes_conj))), num_classes)
+    print(f"[DEBUG]  RSS before level 1: {rss_report()}")
+    raw_subf_by_level[1] = extract_raw_level(1, classes_conj, num_classes, classes_file, num_shards)
 
     # Compute thresholds for level=1
     max_lits, max_vars, min_freq = update_thresholds(1, base_max_lits, base_max_vars, num_classes)
@@ -109,11 +124,15 @@ def main():
     registered_subf_by_level[1] = reg1
     subf_to_name_by_level[1] = name1
     final_subfs[1] = reg1
+    # Raw subformulas are only needed for selection; release them right away
+    del raw_subf_by_level[1]
+    clear_interned_literals()
+    print(f"[DEBUG]  RSS after level 1: {rss_report()}")
 
     print(f"[DEBUG]  → Found {len(reg1)} registered predicates at level 1 "
           f"(MAX_LITS={max_lits}, MAX_VARS={max_vars}, MIN_FREQ={min_freq})")
 
-    objs1 = build_level_objects(1, reg1, name1, S_union)
+    objs1 = build_level_objects(1, reg1, name1, S_index)
     all_level_objects[1] = objs1
     save_level_objects(
         1,
@@ -125,8 +144,8 @@ def main():
     # --- Levels 2, 3, ... until no more raw subformulas ---
     for l in range(2, max_possible_levels + 1):
         print(f"[DEBUG] Building level {l} ...")
-        raw_prev = raw_subf_by_level[l - 1]
-        raw_subf_by_level[l] = extract_level(l, classes_conj, list(range(len(classes_conj))), num_classes)
+        print(f"[DEBUG]  RSS before level {l}: {rss_report()}")
+        raw_subf_by_level[l] = extract_raw_level(l, classes_conj, num_classes, classes_file, num_shards)
         if not raw_subf_by_level[l]:
             print(f"[DEBUG]  No raw subformulas at level {l}. Stopping.")
             break
@@ -151,11 +170,14 @@ def main():
         registered_subf_by_level[l] = reg_l
         subf_to_name_by_level[l] = name_l
         final_subfs[l] = reg_l
+        del raw_subf_by_level[l]
+        clear_interned_literals()
+        print(f"[DEBUG]  RSS after level {l}: {rss_report()}")
 
         print(f"[DEBUG]  → Found {len(reg_l)} registered predicates at level {l} "
               f"(MAX_LITS={max_lits}, MAX_VARS={max_vars}, MIN_FREQ={min_freq})")
 
-        objs_l = build_level_objects(l, reg_l, name_l, S_union)
+        objs_l = build_level_objects(l, reg_l, name_l, S_index)
         all_level_objects[l] = objs_l
         save_level_objects(
             l,
@@ -169,5 +191,25 @@ def main():
 
     print("Done! Please check the output/ directory.")
 
+def main():
+    usage = "Usage: python ml_builder.py <classes_list.txt> <scene.txt> [num_shards]"
+    if len(sys.argv) not in (3, 4):
+        print(usage)
+        sys.exit(1)
+
+    classes_file = sys.argv[1]
+    scene_file = sys.argv[2]
+    num_shards = 1
+    if len(sys.argv) == 4:
+        try:
+            num_shards = int(sys.argv[3])
+        except ValueError:
+            num_shards = 0
+        if num_shards < 1:
+            print(usage)
+            print("num_shards must be a positive integer")
+            sys.exit(1)
+    run(classes_file, scene_file, num_shards)
+
 if __name__ == "__main__":
     main()
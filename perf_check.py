@@ -0,0 +1,344 @@
+﻿# -*- coding: utf-8 -*-
+# perf_check.py
+
+import io
+import os
+import sys
+import json
+import math
+import time
+import random
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+from typing import List, Dict, Tuple, Callable
+
+import ml_builder
+import matcher
+import parser
+import level_finder
+import selector
+import unifier
+import output_writer
+
+# Synthetic datasets: number of classes per dataset, in increasing order
+DATASET_SIZES = [4, 8, 16]
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "perf_baselines.json")
+
+# Pipeline stages of ml_builder.run; "other" covers reading input, thresholds and output
+STAGES = ("extract", "select", "match", "other")
+COUNTERS = ("parse_literal", "unify_two", "dfs_nodes")
+METRICS = ("time",) + COUNTERS + ("peak_mem_kb",)
+
+# Allowed relative excess over the stored baseline value, plus an absolute slack
+# that absorbs noise on very small values. tracemalloc peaks vary by about 1 KB
+# between runs, so the memory slack stays well below the smallest stage peaks.
+# Absolute wall time depends on the machine: its tolerance is wide (3x the baseline)
+# and can be overridden with the PERF_TIME_TOLERANCE environment variable on slow hosts.
+TOLERANCE = {"time": float(os.environ.get("PERF_TIME_TOLERANCE", "2.0")),
+             "parse_literal": 0.05, "unify_two": 0.05, "dfs_nodes": 0.05, "peak_mem_kb": 0.25}
+SLACK = {"time": 0.01, "parse_literal": 0, "unify_two": 0, "dfs_nodes": 0, "peak_mem_kb": 4}
+# Allowed increase of the scaling exponent between consecutive dataset sizes.
+# For time it is taken between the smallest and the largest dataset instead, which
+# halves the effect of timing noise; it is a ratio within one run, so it does not
+# depend on the machine.
+EXPONENT_TOLERANCE = {"time": 1.0, "parse_literal": 0.1, "unify_two": 0.1,
+                      "dfs_nodes": 0.1, "peak_mem_kb": 0.3}
+# Stage times below this (seconds) are too noisy to estimate a scaling exponent
+MIN_TIME_FOR_SCALING = 0.0001
+# Timing runs per dataset: at least TIME_REPEATS, and more until TIME_BUDGET seconds
+# are spent, so the minimum is stable on small datasets too
+TIME_REPEATS = 5
+TIME_BUDGET = 1.0
+
+# --verify: template lengths checked against find_all_matches_multiple; the longest
+# is above matcher.MAX_NESTED_LITERALS and exercises the step-wise matcher
+VERIFY_TEMPLATE_LENGTHS = [5, matcher.MAX_NESTED_LITERALS, 25]
+
+# (predicate, arity) pairs used by the generator
+_PREDICATES = [("P", 2), ("Q", 2), ("R", 1), ("S", 2), ("T", 1), ("U", 2)]
+
+def generate_dataset(n_classes: int, out_dir: str) -> Tuple[str, str]:
+    """
+    Write a fixed synthetic dataset with n_classes classes into out_dir
+    (classes_list.txt, classK.txt, scene.txt) and return the paths of
+    classes_list.txt and scene.txt. The same n_classes always gives the same files.
+    """
+    rng = random.Random(1000 + n_classes)
+    class_paths: List[str] = []
+    for k in range(1, n_classes + 1):
+        conjs: List[str] = []
+        for _ in range(2):
+            lits: List[str] = []
+            for _ in range(rng.randint(3, 5)):
+                pred, arity = rng.choice(_PREDICATES)
+                args = [f"x{rng.randint(1, 5)}" for _ in range(arity)]
+                lits.append(f"{pred}({','.join(args)})")
+            conjs.append("&".join(lits))
+        path = os.path.join(out_dir, f"class{k}.txt")
+        with open(path, "w", encoding="utf-8") as fout:
+            fout.write("\n".join(conjs) + "\n")
+        class_paths.append(path)
+
+    classes_file = os.path.join(out_dir, "classes_list.txt")
+    with open(classes_file, "w", encoding="utf-8") as fout:
+        fout.write("\n".join(class_paths) + "\n")
+
+    scene_file = os.path.join(out_dir, "scene.txt")
+    n_consts = 4 * n_classes
+    with open(scene_file, "w", encoding="utf-8") as fout:
+        for _ in range(8 * n_classes):
+            pred, arity = rng.choice(_PREDICATES)
+            args = [f"c{rng.randint(1, n_consts)}" for _ in range(arity)]
+            fout.write(f"{pred}({','.join(args)})\n")
+    return classes_file, scene_file
+
+class _Recorder:
+    """
+    Collects per-stage metrics while ml_builder.run executes with patched hooks.
+    Memory is tracked in segments: each stage call is one segment, and the code
+    between stage calls belongs to "other". A segment's peak is measured relative
+    to the traced memory at its start, i.e. what that segment allocated on top of
+    memory already held.
+    """
+    def __init__(self, count: bool):
+        self.count = count
+        self.stage = "other"
+        self.segment_start = 0
+        self.metrics: Dict[str, Dict[str, float]] = {
+            st: {m: 0 for m in METRICS} for st in STAGES
+        }
+
+    def open_segment(self):
+        tracemalloc.reset_peak()
+        self.segment_start = tracemalloc.get_traced_memory()[0]
+
+    def close_segment(self, stage: str):
+        peak_kb = (tracemalloc.get_traced_memory()[1] - self.segment_start) / 1024
+        m = self.metrics[stage]
+        m["peak_mem_kb"] = max(m["peak_mem_kb"], round(peak_kb))
+
+    def stage_wrapper(self, stage: str, func: Callable) -> Callable:
+        def wrapped(*args, **kwargs):
+            prev_stage, self.stage = self.stage, stage
+            if self.count:
+                self.close_segment(prev_stage)
+                self.open_segment()
+                nodes_before = matcher.MATCH_NODES[0]
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                m = self.metrics[stage]
+                m["time"] += time.perf_counter() - start
+                if self.count:
+                    m["dfs_nodes"] += matcher.MATCH_NODES[0] - nodes_before
+                    self.close_segment(stage)
+                    self.open_segment()
+                self.stage = prev_stage
+        return wrapped
+
+    def call_counter(self, name: str, func: Callable) -> Callable:
+        def wrapped(*args, **kwargs):
+            self.metrics[self.stage][name] += 1
+            return func(*args, **kwargs)
+        return wrapped
+
+def _run_once(classes_file: str, scene_file: str, count: bool) -> Dict[str, Dict[str, float]]:
+    """
+    Run ml_builder.run once in the current directory and return per-stage metrics.
+    With count=False only stage times are recorded (no call-counting overhead);
+    with count=True call counts, DFS nodes and tracemalloc peaks are recorded.
+    """
+    rec = _Recorder(count)
+    patches: List[Tuple[object, str, object]] = [
+        (ml_builder, "extract_raw_level", rec.stage_wrapper("extract", ml_builder.extract_raw_level)),
+        (ml_builder, "select_and_register_predicates",
+         rec.stage_wrapper("select", ml_builder.select_and_register_predicates)),
+        (ml_builder, "build_level_objects", rec.stage_wrapper("match", ml_builder.build_level_objects)),
+    ]
+    if count:
+        for mod in (parser, level_finder, selector, matcher, unifier, ml_builder, output_writer):
+            patches.append((mod, "parse_literal", rec.call_counter("parse_literal", parser.parse_literal)))
+        patches.append((matcher, "unify_two", rec.call_counter("unify_two", matcher.unify_two)))
+        # Registration (selector) and matching (ml_builder) must both get the counting
+        # variant, so each template is compiled once, in select, as in a normal run
+        counting_compile = lambda lits: matcher.compile_matcher(lits, count_nodes=True)
+        patches.append((selector, "compile_matcher", counting_compile))
+        patches.append((ml_builder, "compile_matcher", counting_compile))
+
+    # Start every run from cold caches so runs are comparable
+    matcher._COMPILED_MATCHERS.clear()
+    matcher._COUNTING_MATCHERS.clear()
+    matcher.MATCH_NODES[0] = 0
+
+    originals = [(mod, name, getattr(mod, name)) for mod, name, _ in patches]
+    for mod, name, value in patches:
+        setattr(mod, name, value)
+    if count:
+        tracemalloc.start()
+        rec.open_segment()
+    start = time.perf_counter()
+    try:
+        with redirect_stdout(io.StringIO()):
+            ml_builder.run(classes_file, scene_file)
+    finally:
+        total = time.perf_counter() - start
+        if count:
+            rec.close_segment("other")
+            tracemalloc.stop()
+        for mod, name, value in originals:
+            setattr(mod, name, value)
+
+    staged = sum(rec.metrics[st]["time"] for st in STAGES if st != "other")
+    rec.metrics["other"]["time"] = total - staged
+    return rec.metrics
+
+def measure(n_classes: int) -> Dict[str, Dict[str, float]]:
+    """
+    Measure one synthetic dataset: stage times are the minimum over uninstrumented
+    runs (see TIME_REPEATS, TIME_BUDGET); counters and memory come from one
+    instrumented run.
+    """
+    with tempfile.TemporaryDirectory(prefix="ml_perf_") as work_dir:
+        classes_file, scene_file = generate_dataset(n_classes, work_dir)
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            timings = []
+            deadline = time.perf_counter() + TIME_BUDGET
+            while len(timings) < TIME_REPEATS or time.perf_counter() < deadline:
+                timings.append(_run_once(classes_file, scene_file, count=False))
+            result = _run_once(classes_file, scene_file, count=True)
+        finally:
+            os.chdir(cwd)
+    for st in STAGES:
+        result[st]["time"] = round(min(t[st]["time"] for t in timings), 4)
+    return result
+
+def measure_all() -> Dict[str, Dict[str, Dict[str, float]]]:
+    return {str(n): measure(n) for n in DATASET_SIZES}
+
+def _exponent(v_a: float, v_b: float, n_a: int, n_b: int) -> float:
+    return math.log(v_b / v_a) / math.log(n_b / n_a)
+
+def compare(current: Dict, baseline: Dict) -> List[str]:
+    """
+    Compare measured metrics with the baseline. Returns a list of failure messages:
+      - a metric exceeding its baseline by more than TOLERANCE (+ SLACK);
+      - a stage whose scaling exponent between consecutive dataset sizes (for time:
+        between the smallest and the largest) grew by more than EXPONENT_TOLERANCE
+        compared to the baseline.
+    """
+    failures: List[str] = []
+    for size in map(str, DATASET_SIZES):
+        if size not in baseline:
+            failures.append(f"no baseline for dataset size {size}; run with --update")
+            continue
+        for st in STAGES:
+            for m in METRICS:
+                cur = current[size][st][m]
+                base = baseline[size][st][m]
+                limit = base * (1 + TOLERANCE[m]) + SLACK[m]
+                if cur > limit:
+                    failures.append(f"[size {size}] {st}.{m} = {cur:.4g} exceeds baseline "
+                                    f"{base:.4g} (limit {limit:.4g})")
+
+    consecutive = list(zip(DATASET_SIZES, DATASET_SIZES[1:]))
+    full_range = [(DATASET_SIZES[0], DATASET_SIZES[-1])]
+    for m in METRICS:
+        for n_a, n_b in (full_range if m == "time" else consecutive):
+            a, b = str(n_a), str(n_b)
+            if a not in baseline or b not in baseline:
+                continue
+            for st in STAGES:
+                values = (current[a][st][m], current[b][st][m], baseline[a][st][m], baseline[b][st][m])
+                if min(values) <= 0:
+                    continue
+                if m == "time" and min(values) < MIN_TIME_FOR_SCALING:
+                    continue
+                cur_exp = _exponent(values[0], values[1], n_a, n_b)
+                base_exp = _exponent(values[2], values[3], n_a, n_b)
+                if cur_exp > base_exp + EXPONENT_TOLERANCE[m]:
+                    failures.append(f"[size {a}->{b}] {st}.{m} scales as n^{cur_exp:.2f}, "
+                                    f"baseline n^{base_exp:.2f}")
+    return failures
+
+def print_report(current: Dict):
+    for size in map(str, DATASET_SIZES):
+        print(f"Dataset with {size} classes:")
+        for st in STAGES:
+            m = current[size][st]
+            print(f"  {st:8s} time={m['time']:.4f}s parse_literal={m['parse_literal']} "
+                  f"unify_two={m['unify_two']} dfs_nodes={m['dfs_nodes']} "
+                  f"peak_mem={m['peak_mem_kb']:.0f}KB")
+
+def verify_long_templates() -> List[str]:
+    """
+    Check compiled matchers against find_all_matches_multiple on chain templates
+    P(x1,x2)&P(x2,x3)&... of VERIFY_TEMPLATE_LENGTHS literals, over a scene with
+    a long P-chain with dead-end branches.
+    """
+    from collections import Counter
+
+    scene = [("P", [f"c{k}", f"c{k + 1}"]) for k in range(1, 40)]
+    scene += [("P", [f"c{k}", f"d{k}"]) for k in range(1, 40, 3)]
+    scene_index = matcher.index_scene(scene)
+
+    failures: List[str] = []
+    for length in VERIFY_TEMPLATE_LENGTHS:
+        lits = tuple(sorted(f"P(x{k},x{k + 1})" for k in range(1, length + 1)))
+        expected = Counter(tuple(sorted(m.items()))
+                           for m in matcher.find_all_matches_multiple(list(lits), scene))
+        try:
+            got = Counter(tuple(sorted(m.items())) for m in matcher.compile_matcher(lits)(scene_index))
+        except SyntaxError as ex:
+            failures.append(f"{length}-literal template does not compile: {ex}")
+            continue
+        if got != expected:
+            failures.append(f"{length}-literal template: compiled matcher differs from "
+                            f"find_all_matches_multiple")
+    return failures
+
+def main():
+    modes = ("--update", "--verify")
+    if len(sys.argv) > 2 or (len(sys.argv) == 2 and sys.argv[1] not in modes):
+        print("Usage: python perf_check.py [--update | --verify]")
+        sys.exit(1)
+
+    if len(sys.argv) == 2 and sys.argv[1] == "--verify":
+        failures = verify_long_templates()
+        if failures:
+            print("Verification failures:")
+            for msg in failures:
+                print("  " + msg)
+            sys.exit(1)
+        print("Verification passed.")
+        return
+
+    current = measure_all()
+    print_report(current)
+
+    if len(sys.argv) == 2:
+        with open(BASELINE_FILE, "w", encoding="utf-8") as fout:
+            json.dump(current, fout, indent=2, sort_keys=True)
+            fout.write("\n")
+        print(f"Baselines written to {BASELINE_FILE}")
+        return
+
+    if not os.path.exists(BASELINE_FILE):
+        print(f"No baseline file {BASELINE_FILE}; run: python perf_check.py --update")
+        sys.exit(1)
+    with open(BASELINE_FILE, "r", encoding="utf-8") as fin:
+        baseline = json.load(fin)
+
+    failures = compare(current, baseline)
+    if failures:
+        print("Performance regressions:")
+        for msg in failures:
+            print("  " + msg)
+        sys.exit(1)
+    print("No performance regressions.")
+
+if __name__ == "__main__":
+    main()
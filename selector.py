@@ -5,11 +5,12 @@ from collections import defaultdict
 from typing import List, Dict, Set, Tuple
 
 from utils import MIN_FREQ, MAX_LITERALS, MAX_VARS
-from subformula import Subformula
+from subformula import Subformula, RawSubformula
 from parser import parse_literal
+from matcher import compile_matcher
 
 def select_and_register_predicates(
-    raw_subfs: List[Dict],
+    raw_subfs: List[RawSubformula],
     parent_class_map: List[int],
     registered_subfs: List[Subformula],
     subf_to_name: Dict[Subformula, str],
@@ -17,7 +18,7 @@ def select_and_register_predicates(
     level: int
 ):
     """
-    From raw_subfs (each entry: {'literals': [...], 'origins': [(i,j), ...]}),
+    From raw_subfs (each entry: RawSubformula with .literals and .origins pairs (i,j)),
     compute frequency of each unique set of literals across distinct classes.
     Filter by:
        - frequency >= MIN_FREQ
@@ -29,12 +30,13 @@ def select_and_register_predicates(
       - registered_subfs (list of Subformula objects)
       - subf_to_name: map from Subformula to its predicate name
       - subf_to_vars: map from Subformula to ordered list of its variables
+    Each registered Subformula is compiled into a matcher (cached by its literal tuple).
     """
     # Build a map: literal‐tuple → set of class‐indices where it occurs
     freq_map: Dict[Tuple[str, ...], Set[int]] = defaultdict(set)
     for entry in raw_subfs:
-        lit_tuple = tuple(sorted(entry['literals']))
-        for (i, j) in entry['origins']:
+        lit_tuple = entry.literals  # already sorted and interned
+        for (i, j) in entry.origins:
             ci = parent_class_map[i]
             cj = parent_class_map[j]
             freq_map[lit_tuple].add(ci)
@@ -61,7 +63,7 @@ def select_and_register_predicates(
                 if a.islower():
                     vars_set.add(a)
         num_vars = len(vars_set)
-        subf = Subformula(list(lit_tuple))
+        subf = Subformula(lit_tuple)
         candidates.append(Candidate(subf, freq, num_vars))
 
     # Filter candidates by literal‐count and var‐count
@@ -110,5 +112,6 @@ def select_and_register_predicates(
                     vars_order.append(a)
                     seen_vars.add(a)
         subf_to_vars[sf] = vars_order.copy()
+        compile_matcher(sf.literals)
 
         idx_counter += 1
@@ -0,0 +1,183 @@
+﻿# -*- coding: utf-8 -*-
+# sharding.py
+
+import os
+import sys
+import random
+import subprocess
+import tempfile
+from typing import List, Dict, Tuple, Optional
+
+from parser import read_classes_list
+from level_finder import extract_level, class_pairs
+from subformula import RawSubformula
+
+# --verify: synthetic catalogue sizes and shard counts compared with extract_level
+VERIFY_SIZES = [2, 5, 9]
+VERIFY_SHARDS = [2, 3, 7]
+
+def split_pairs(
+    n_classes: int,
+    parent_class_map: List[int],
+    num_shards: int
+) -> List[List[Tuple[int, int]]]:
+    """
+    Split the (i,j) class-pair space into `num_shards` contiguous shards.
+    Shards keep the global pair order of extract_level, so merging them in
+    shard order reproduces a single-process run exactly.
+    """
+    pairs = list(class_pairs(n_classes, parent_class_map))
+    n = len(pairs)
+    return [pairs[k * n // num_shards:(k + 1) * n // num_shards] for k in range(num_shards)]
+
+def shard_path(shard_dir: str, level: int, shard_index: int) -> str:
+    return os.path.join(shard_dir, f"level{level}_shard{shard_index}.txt")
+
+def write_shard(path: str, raw_subfs: List[RawSubformula]):
+    """
+    Write a shard file: one raw subformula per line,
+      lit1&lit2&...<TAB>i,j i,j ...
+    The file is written under a temporary name and renamed when complete,
+    so a reader never sees a partially written shard.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fout:
+        for raw in raw_subfs:
+            origins = " ".join(f"{i},{j}" for i, j in raw.origins)
+            fout.write("&".join(raw.literals) + "\t" + origins + "\n")
+    os.replace(tmp_path, path)
+
+def read_shard(path: str) -> List[RawSubformula]:
+    """
+    Read a shard file written by write_shard.
+    """
+    raw_subfs: List[RawSubformula] = []
+    with open(path, "r", encoding="utf-8") as fin:
+        for line in fin:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            lits_part, origins_part = line.split("\t")
+            raw = RawSubformula(lits_part.split("&"))
+            for pair in origins_part.split():
+                i, j = pair.split(",")
+                raw.add_origin(int(i), int(j))
+            raw_subfs.append(raw)
+    return raw_subfs
+
+def merge_shards(paths: List[str]) -> List[RawSubformula]:
+    """
+    Merge shard files (given in shard order) into the raw_subfs list expected by
+    select_and_register_predicates. As in extract_level, only the first occurrence
+    of each literal tuple is kept, so the result equals a single-process run.
+    """
+    merged: Dict[Tuple[str, ...], RawSubformula] = {}
+    for path in paths:
+        for raw in read_shard(path):
+            if raw.literals not in merged:
+                merged[raw.literals] = raw
+    return list(merged.values())
+
+def run_worker(classes_file: str, level: int, shard_index: int, num_shards: int, out_path: str):
+    """
+    Worker entry point: compute the raw subformulas of one shard and write its shard file.
+    """
+    classes_conj, num_classes = read_classes_list(classes_file)
+    parent_class_map = list(range(num_classes))
+    shards = split_pairs(num_classes, parent_class_map, num_shards)
+    raw_subfs = extract_level(level, classes_conj, parent_class_map, num_classes,
+                              pairs=shards[shard_index])
+    write_shard(out_path, raw_subfs)
+
+def extract_level_sharded(
+    level: int,
+    classes_file: str,
+    num_shards: int,
+    shard_dir: Optional[str] = None
+) -> List[RawSubformula]:
+    """
+    Local coordinator: start one worker process per shard (standing in for a node),
+    wait for all of them, then merge their shard files.
+    If shard_dir is None, a temporary directory is used and removed afterwards.
+    """
+    if shard_dir is None:
+        with tempfile.TemporaryDirectory(prefix="ml_shards_") as tmp_dir:
+            return extract_level_sharded(level, classes_file, num_shards, tmp_dir)
+
+    os.makedirs(shard_dir, exist_ok=True)
+    worker_script = os.path.abspath(__file__)
+    paths = [shard_path(shard_dir, level, k) for k in range(num_shards)]
+    procs = [
+        subprocess.Popen([sys.executable, worker_script, classes_file,
+                          str(level), str(k), str(num_shards), paths[k]])
+        for k in range(num_shards)
+    ]
+    failed = [k for k, proc in enumerate(procs) if proc.wait() != 0]
+    if failed:
+        raise RuntimeError(f"Shard workers failed at level {level}: {failed}")
+    return merge_shards(paths)
+
+def _write_verify_classes(n_classes: int, out_dir: str) -> str:
+    """
+    Write a fixed random catalogue of n_classes classes into out_dir
+    and return the path of its classes_list.txt.
+    """
+    rng = random.Random(n_classes)
+    class_paths: List[str] = []
+    for k in range(1, n_classes + 1):
+        conjs: List[str] = []
+        for _ in range(2):
+            lits = [f"{rng.choice('PQRS')}(x{rng.randint(1, 4)},x{rng.randint(1, 4)})"
+                    for _ in range(rng.randint(2, 5))]
+            conjs.append("&".join(lits))
+        path = os.path.join(out_dir, f"class{k}.txt")
+        with open(path, "w", encoding="utf-8") as fout:
+            fout.write("\n".join(conjs) + "\n")
+        class_paths.append(path)
+    classes_file = os.path.join(out_dir, "classes_list.txt")
+    with open(classes_file, "w", encoding="utf-8") as fout:
+        fout.write("\n".join(class_paths) + "\n")
+    return classes_file
+
+def _raw_as_lists(raw_subfs: List[RawSubformula]) -> List[Tuple[Tuple[str, ...], List[Tuple[int, int]]]]:
+    return [(tuple(raw.literals), list(raw.origins)) for raw in raw_subfs]
+
+def verify() -> List[str]:
+    """
+    Check that extract_level_sharded with VERIFY_SHARDS workers gives exactly the
+    raw subformulas (literals, origins and order) of a single-process extract_level,
+    on catalogues of VERIFY_SIZES classes, for every level that has raw subformulas.
+    Returns a list of failure messages.
+    """
+    failures: List[str] = []
+    for n_classes in VERIFY_SIZES:
+        with tempfile.TemporaryDirectory(prefix="ml_verify_") as work_dir:
+            classes_file = _write_verify_classes(n_classes, work_dir)
+            classes_conj, num_classes = read_classes_list(classes_file)
+            for level in range(1, num_classes + 3):
+                expected = _raw_as_lists(extract_level(level, classes_conj,
+                                                       list(range(num_classes)), num_classes))
+                for num_shards in VERIFY_SHARDS:
+                    got = _raw_as_lists(extract_level_sharded(level, classes_file, num_shards))
+                    if got != expected:
+                        failures.append(f"[{n_classes} classes] level {level}: {num_shards} shards "
+                                        f"differ from the single-process run")
+                if not expected:
+                    break
+    return failures
+
+if __name__ == "__main__":
+    if len(sys.argv) == 2 and sys.argv[1] == "--verify":
+        failures = verify()
+        if failures:
+            print("Verification failures:")
+            for msg in failures:
+                print("  " + msg)
+            sys.exit(1)
+        print("Sharded extraction matches the single-process run.")
+        sys.exit(0)
+    if len(sys.argv) != 6:
+        print("Usage: python sharding.py <classes_list.txt> <level> <shard_index> <num_shards> <out_file>")
+        print("       python sharding.py --verify")
+        sys.exit(1)
+    run_worker(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]), sys.argv[5])
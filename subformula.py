@@ -1,20 +1,54 @@
 ﻿# -*- coding: utf-8 -*-
 # subformula.py
 
-from typing import List
+import sys
+from array import array
+from typing import Dict, Iterable, Iterator, Tuple
+
+# Canonical (sorted, interned) literal tuples shared by every Subformula and
+# RawSubformula built from the same set of literals. The table is scoped to one
+# level: ml_builder clears it once that level's selection is done, so tuples
+# rejected by selection are freed together with the level's raw subformulas.
+_LITERAL_TUPLES: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+
+def intern_literals(literals: Iterable[str]) -> Tuple[str, ...]:
+    """
+    Return the canonical sorted tuple for the given literals.
+    Each literal string is interned, and equal tuples are shared between callers,
+    so repeated subformulas cost one reference instead of a fresh list of strings.
+    """
+    key = tuple(sorted(literals))
+    canon = _LITERAL_TUPLES.get(key)
+    if canon is None:
+        canon = tuple(sys.intern(lit) for lit in key)
+        _LITERAL_TUPLES[canon] = canon
+    return canon
+
+def clear_interned_literals():
+    """
+    Drop the intern table. Tuples still used by registered Subformulas stay alive;
+    all others are released.
+    """
+    _LITERAL_TUPLES.clear()
 
 class Subformula:
     """
     Represents a conjunction of literals.
-    For hashing and equality, store literals in a sorted tuple.
+    For hashing and equality, store literals in a sorted (interned) tuple.
     """
-    def __init__(self, literals: List[str]):
+    __slots__ = ('_lit_tuple', '_hash')
+
+    def __init__(self, literals: Iterable[str]):
         # Sort literals alphabetically for deterministic ordering
-        self.literals = sorted(literals)
-        self._lit_tuple = tuple(self.literals)
+        self._lit_tuple = intern_literals(literals)
+        self._hash = hash(self._lit_tuple)
+
+    @property
+    def literals(self) -> Tuple[str, ...]:
+        return self._lit_tuple
 
     def __hash__(self):
-        return hash(self._lit_tuple)
+        return self._hash
 
     def __eq__(self, other):
         if not isinstance(other, Subformula):
@@ -22,7 +56,31 @@ class Subformula:
         return self._lit_tuple == other._lit_tuple
 
     def __len__(self):
-        return len(self.literals)
+        return len(self._lit_tuple)
+
+    def __repr__(self):
+        return f"Subformula({','.join(self._lit_tuple)})"
+
+class RawSubformula:
+    """
+    A raw (not yet selected) subformula produced by extract_level.
+    Literals are kept as a canonical interned tuple; origins (i,j) class pairs
+    are packed into a flat array of ints: [i0, j0, i1, j1, ...].
+    """
+    __slots__ = ('literals', '_origins')
+
+    def __init__(self, literals: Iterable[str]):
+        self.literals = intern_literals(literals)
+        self._origins = array('i')
+
+    def add_origin(self, i: int, j: int):
+        self._origins.append(i)
+        self._origins.append(j)
+
+    @property
+    def origins(self) -> Iterator[Tuple[int, int]]:
+        o = self._origins
+        return ((o[k], o[k + 1]) for k in range(0, len(o), 2))
 
     def __repr__(self):
-        return f"Subformula({','.join(self.literals)})"
+        return f"RawSubformula({','.join(self.literals)})"
@@ -1,8 +1,15 @@
 ﻿# -*- coding: utf-8 -*-
 # utils.py
 
+import os
+import sys
 from typing import Tuple
 
+try:
+    import resource  # not available on Windows
+except ImportError:
+    resource = None
+
 # Default thresholds (will be overridden in ml_builder via update_thresholds)
 MIN_FREQ = 1
 MAX_LITERALS = 10
@@ -22,3 +29,35 @@ def update_thresholds(level: int,
     max_vars = max(1, base_max_vars * 2 - (level - 1))
     min_freq = max(1, num_classes // (2 ** level))
     return max_lits, max_vars, min_freq
+
+def peak_rss_mb() -> float:
+    """
+    Return the peak resident set size of the current process in MB,
+    or -1.0 if it cannot be determined on this platform.
+    """
+    if resource is None:
+        return -1.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+def current_rss_mb() -> float:
+    """
+    Return the current resident set size of the process in MB (from /proc/self/statm),
+    or -1.0 if it cannot be determined on this platform.
+    Unlike the peak, this value goes down when memory is released.
+    """
+    try:
+        with open("/proc/self/statm", "r") as fin:
+            resident_pages = int(fin.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return -1.0
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+def rss_report() -> str:
+    """
+    Format current and peak RSS for the debug log.
+    """
+    return f"current {current_rss_mb():.1f} MB, peak {peak_rss_mb():.1f} MB"